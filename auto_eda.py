@@ -6,16 +6,22 @@ import matplotlib.pyplot as plt
 from wordcloud import WordCloud
 from collections import Counter
 from tqdm import tqdm
-from bson import ObjectId
+from functools import lru_cache
 import pandas as pd
 
 from transformers import pipeline
-from db import collection
+from db import get_page_texts
+from metrics import timed, timed_model_load, register_cache
 
 from sklearn.feature_extraction.text import CountVectorizer
 
-# summarizer model
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
+# summarizer model (loaded on first use)
+@lru_cache(maxsize=1)
+def get_summarizer():
+    with timed_model_load("summarization:facebook/bart-large-cnn"):
+        return pipeline("summarization", model="facebook/bart-large-cnn")
+
+register_cache("summarizer", get_summarizer)
 
 # --- Helper Functions ---
 
@@ -23,14 +29,12 @@ def fetch_document_text(document_id):
     """
     Fetch the text from a single document by ID.
     """
-    doc = collection.find_one({"_id": ObjectId(document_id)})
-    if not doc:
+    page_texts = get_page_texts(document_id)
+    if page_texts is None:
         raise ValueError(f"No document found with id: {document_id}")
-    
+
     all_texts = []
-    pages = doc.get("pages", [])
-    for page in pages:
-        text = page.get("text", "")
+    for text in page_texts:
         if text.strip():
             all_texts.append(text.strip())
     return all_texts
@@ -97,7 +101,8 @@ def perform_ner_collect(texts):
     """
     Perform Named Entity Recognition and collect entities.
     """
-    ner_pipeline = pipeline("ner", model="dslim/bert-base-NER", grouped_entities=True)
+    with timed_model_load("ner:dslim/bert-base-NER"):
+        ner_pipeline = pipeline("ner", model="dslim/bert-base-NER", grouped_entities=True)
     entities = []
     for text in texts:
         if not text.strip():
@@ -113,7 +118,8 @@ def perform_sentiment_analysis_collect(texts):
     """
     Perform Sentiment Analysis and collect labels.
     """
-    sentiment_pipeline = pipeline("sentiment-analysis")
+    with timed_model_load("sentiment-analysis"):
+        sentiment_pipeline = pipeline("sentiment-analysis")
     sentiments = []
     for text in texts:
         if not text.strip():
@@ -174,7 +180,7 @@ def summarize_texts(texts, max_tokens=1024):
     full_text = full_text[:max_tokens]  # Make sure it doesn't exceed model limits
 
     try:
-        summary = summarizer(full_text, max_length=200, min_length=50, do_sample=False)
+        summary = get_summarizer()(full_text, max_length=200, min_length=50, do_sample=False)
         return summary[0]['summary_text']
     except Exception as e:
         print(f"Summarization error: {e}")
@@ -197,7 +203,8 @@ def full_eda_batch(document_ids, base_output_dir="outputs"):
     for doc_id in tqdm(document_ids, desc="Running batch EDA"):
         # Create a subfolder for each document
         doc_output_dir = os.path.join(base_output_dir, str(doc_id))
-        texts = fetch_document_text(doc_id)
+        with timed("eda.fetch"):
+            texts = fetch_document_text(doc_id)
 
         if not texts:
             print(f"No text found for document {doc_id}")
@@ -211,24 +218,29 @@ def full_eda_batch(document_ids, base_output_dir="outputs"):
         cleaned_texts = clean_texts(texts)
 
         # Run EDA steps, but save each document's plots separately
-        plot_word_frequency(cleaned_texts, output_dir=doc_output_dir)
-        plot_wordcloud(cleaned_texts, output_dir=doc_output_dir)
-        plot_top_bigrams(cleaned_texts, output_dir=doc_output_dir)
+        with timed("eda.plots"):
+            plot_word_frequency(cleaned_texts, output_dir=doc_output_dir)
+            plot_wordcloud(cleaned_texts, output_dir=doc_output_dir)
+            plot_top_bigrams(cleaned_texts, output_dir=doc_output_dir)
 
         # Perform NER and collect entities
-        entities = perform_ner_collect(cleaned_texts)
+        with timed("eda.ner"):
+            entities = perform_ner_collect(cleaned_texts)
         all_entities.extend(entities)
 
         # Perform sentiment and collect sentiments
-        sentiments = perform_sentiment_analysis_collect(cleaned_texts)
+        with timed("eda.sentiment"):
+            sentiments = perform_sentiment_analysis_collect(cleaned_texts)
         all_sentiments.extend(sentiments)
 
         # Save per-document plots
-        plot_top_entities(entities, output_dir=doc_output_dir)
-        plot_sentiment_distribution(sentiments, output_dir=doc_output_dir)
+        with timed("eda.plots"):
+            plot_top_entities(entities, output_dir=doc_output_dir)
+            plot_sentiment_distribution(sentiments, output_dir=doc_output_dir)
 
         # Summarize the document
-        doc_summary = summarize_texts(cleaned_texts)
+        with timed("eda.summarize"):
+            doc_summary = summarize_texts(cleaned_texts)
 
         # Collect simple stats
         doc_stats = {
@@ -45,7 +45,7 @@ const DocumentUpload: React.FC = () => {
     const fetchDocumentIds = async () => {
         try {
             const response = await axios.get('http://localhost:8000/documents/');
-            const ids = response.data.map((doc: { id: string }) => doc.id);
+            const ids = response.data.documents.map((doc: { id: string }) => doc.id);
             setDocumentIds(ids);
             setMessage('Retrieved document IDs successfully.');
             console.log('Document IDs:', ids);
@@ -14,7 +14,7 @@ export default function Documents() {
       const fetchDocuments = async () => {
         try {
           const response = await axios.get('http://localhost:8000/documents/');
-          setCards(response.data);
+          setCards(response.data.documents);
         } catch (error) {
           console.error('Error fetching documents:', error);
         }
@@ -19,7 +19,7 @@ export const DocumentProvider: React.FC<{ children: React.ReactNode }> = ({ chil
   const fetchDocuments = async () => {
     try {
       const response = await axios.get('http://localhost:8000/documents/');
-      setDocuments(response.data);
+      setDocuments(response.data.documents);
     } catch (error) {
       console.error('Error fetching documents:', error);
     }
@@ -0,0 +1,431 @@
+"""
+End-to-end benchmark for the autopdf pipeline.
+
+Generates synthetic digital and scanned PDFs with PyMuPDF, then times each
+stage (render, OCR, tables, images, merge, store, chunk, embed, index,
+ingest, ingest_warm, query, QA, EDA, translate) against an empty local Mongo
+stand-in with a stub translator and stub LLM. "ingest" extracts every page;
+"ingest_warm" re-ingests the same file with page reuse on. Reports pages/sec, p50/p95 latency and the
+process's peak RSS so far after each stage, and saves the results as JSON
+so runs can be compared.
+
+Usage:
+    python benchmark.py --pages 50
+    python benchmark.py --pages 200 --kinds scanned --stub-embeddings
+    python benchmark.py --pages 50 --compare outputs/benchmarks/benchmark-<timestamp>.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# db.py requires a URI at import time; the benchmark swaps in a stand-in client below
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+
+import chromadb
+import fitz  # PyMuPDF
+import pytesseract
+
+import db
+import pdf_utils
+import semantic_search_qa
+import translation
+import auto_eda
+import metrics
+from main import ingest_pdf, page_to_document
+from models import PageData
+
+WORDS = (
+    "report agency budget program federal analysis committee water energy "
+    "health policy data review fiscal year growth rate district survey "
+    "regional estimate national funding operations results method sample"
+).split()
+
+QUERIES = [
+    "What was the budget for the program?",
+    "Summarize the regional survey results.",
+    "Which district had the highest growth rate?",
+    "How was the sample estimated?",
+]
+
+# --- Synthetic corpus ---
+
+def random_sentence(rng, n_words=12):
+    words = [rng.choice(WORDS) for _ in range(n_words)]
+    return " ".join(words).capitalize() + "."
+
+def make_digital_pdf(path, pages, seed=0):
+    """
+    Write a text PDF where every page has paragraphs, a ruled table and a captioned figure.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for n in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Section {n + 1}", fontsize=16)
+
+        body = " ".join(random_sentence(rng) for _ in range(12))
+        page.insert_textbox(fitz.Rect(72, 90, 540, 300), body, fontsize=10)
+
+        # Table: 4 columns, a header and 6 rows, separated by horizontal rules
+        columns = [72, 200, 320, 440]
+        y = 320
+        for row in range(7):
+            cells = ["Region", "Budget", "Growth", "Sample"] if row == 0 else [
+                rng.choice(WORDS).title(),
+                f"{rng.randint(100, 9999)}",
+                f"{rng.uniform(0, 10):.1f}%",
+                f"{rng.randint(10, 500)}",
+            ]
+            for x, cell in zip(columns, cells):
+                page.insert_text((x, y), cell, fontsize=10)
+            page.draw_line((72, y + 4), (540, y + 4), width=0.5)
+            y += 18
+
+        # Figure: a solid image with a caption underneath
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+        pix.set_rect(pix.irect, (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+        page.insert_image(fitz.Rect(72, 460, 272, 610), pixmap=pix)
+        page.insert_text((72, 630), f"Figure {n + 1}: {random_sentence(rng, 6)}", fontsize=9)
+
+        page.insert_textbox(fitz.Rect(72, 650, 540, 760), random_sentence(rng, 30), fontsize=10)
+    doc.save(path)
+    doc.close()
+
+def make_scanned_pdf(source_path, path, dpi=150):
+    """
+    Rasterize each page of a PDF into an image-only page, like a scanned report.
+    """
+    source = fitz.open(source_path)
+    doc = fitz.open()
+    for page in source:
+        pix = page.get_pixmap(dpi=dpi)
+        new_page = doc.new_page(width=page.rect.width, height=page.rect.height)
+        new_page.insert_image(new_page.rect, pixmap=pix)
+    doc.save(path)
+    doc.close()
+    source.close()
+
+# --- Stand-ins ---
+
+def use_mongo_stand_in(mongo_uri=None):
+    """
+    Point db.py at an empty benchmark database: mongomock by default, or a real server if a URI is given.
+    """
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required for the default Mongo stand-in (pip install mongomock), or pass --mongo-uri.")
+        client = mongomock.MongoClient()
+
+    # Start empty so pages stored by an earlier run cannot be reused by this one
+    client.drop_database("pdf_mining_benchmark")
+    db.client = client
+    db.db = client["pdf_mining_benchmark"]
+    db.collection = db.db["documents"]
+    db.pages_collection = db.db["pages"]
+    db.ensure_indexes()
+
+class StubTranslator:
+    async def translate(self, text, dest="es"):
+        return SimpleNamespace(text=text)
+
+class StubLLM:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate(self, prompt):
+        return prompt[-200:]
+
+def stub_pipeline(task, *args, **kwargs):
+    """
+    Stand-in for transformers.pipeline used by the EDA stage.
+    """
+    if task == "summarization":
+        return lambda text, **kw: [{"summary_text": text[:200]}]
+    if task == "ner":
+        return lambda text, **kw: [{"word": w} for w in text.split() if w[:1].isupper()]
+    return lambda text, **kw: [{"label": "POSITIVE", "score": 1.0}]
+
+def install_stubs(stub_embeddings=False):
+    translation.Translator = StubTranslator
+    semantic_search_qa.GPT4All = StubLLM
+    auto_eda.pipeline = stub_pipeline
+    auto_eda.get_summarizer.cache_clear()
+    if stub_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        fake = DeterministicFakeEmbedding(size=384)
+        semantic_search_qa.get_embedding_function = lambda: fake
+
+# --- Measurement ---
+
+def peak_rss_mb():
+    """
+    Peak RSS of the whole process so far, in MB. This is a high-water mark, so the
+    value recorded after a stage is the cumulative peak up to that stage, not the
+    stage's own usage. Returns None if neither resource nor psutil is available.
+    """
+    if resource is not None:
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    info = psutil.Process().memory_info()
+    # peak_wset is the peak working set on Windows
+    return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+class StageTimer:
+    """
+    Collect per-call latencies for named stages.
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.pages = {}
+        self.rss = {}
+
+    def time(self, stage, func, *args, pages=0, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - start)
+        self.pages[stage] = self.pages.get(stage, 0) + pages
+        self.rss[stage] = peak_rss_mb()
+        return result
+
+    def report(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            total = sum(samples)
+            pages = self.pages.get(stage, 0)
+            stages[stage] = {
+                "calls": len(samples),
+                "total_s": round(total, 4),
+                "p50_ms": round(percentile(samples, 50) * 1000, 3),
+                "p95_ms": round(percentile(samples, 95) * 1000, 3),
+                "pages": pages,
+                "pages_per_sec": round(pages / total, 3) if pages and total else None,
+                "cumulative_peak_rss_mb": round(self.rss[stage], 1) if self.rss[stage] is not None else None,
+            }
+        return stages
+
+# --- Stages ---
+
+def bench_extraction(timer, pdf_path):
+    """
+    Time the per-page extraction steps separately and return the page records.
+    """
+    doc = fitz.open(pdf_path)
+    pages = []
+    zoom = 2
+    for i, page in enumerate(doc):
+        native_text = page.get_text().strip()
+        image = timer.time("render", pdf_utils.render_page_as_image, page, zoom=zoom, pages=1)
+        ocr_text = timer.time("ocr", lambda: pytesseract.image_to_string(image).strip(), pages=1)
+        tables = timer.time("tables", pdf_utils.extract_page_tables, page, image, zoom=zoom, ocr_text=ocr_text, pages=1)
+        images, captions = timer.time("images", pdf_utils.extract_images_with_captions, doc, page, pages=1)
+        text = timer.time("merge", pdf_utils.merge_text, native_text, ocr_text, pages=1)
+        pages.append({
+            "page_number": i + 1,
+            "text": text,
+            "tables": tables,
+            "figure_captions": captions,
+            "images": images,
+        })
+    doc.close()
+    return pages
+
+def bench_storage_and_indexing(timer, pages, filename):
+    document_id = db.insert_document({"filename": filename, "uploaded_at": datetime.utcnow()})
+
+    with db.PageWriter(document_id) as page_writer:
+        for page in pages:
+            timer.time("store", page_writer.add, PageData(**page).dict(), pages=1)
+        timer.time("store", page_writer.flush)
+
+    chunks = []
+    for page in pages:
+        doc = page_to_document(page, document_id)
+        if doc is not None:
+            chunks.extend(timer.time("chunk", semantic_search_qa.split_documents, [doc], pages=1))
+    chunks = semantic_search_qa.calculate_chunk_ids(chunks)
+
+    # Embed once, then write the precomputed vectors, so "index" measures only the
+    # Chroma lookup and write (add_to_chroma would embed the chunks a second time)
+    embedding_function = semantic_search_qa.get_embedding_function()
+    collection = chromadb.PersistentClient(path=semantic_search_qa.CHROMA_PATH).get_or_create_collection("langchain")
+    batch_size = semantic_search_qa.CHROMA_BATCH_SIZE
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        embeddings = timer.time("embed", embedding_function.embed_documents, [c.page_content for c in batch])
+        timer.time("index", index_precomputed, collection, batch, embeddings)
+
+    return document_id, len(chunks)
+
+def index_precomputed(collection, chunks, embeddings):
+    """
+    Same lookup-then-add as add_to_chroma, with embeddings supplied by the caller.
+    Writes to the collection langchain_chroma uses by default, so the query stages see these chunks.
+    """
+    ids = [chunk.metadata["id"] for chunk in chunks]
+    existing_ids = set(collection.get(ids=ids, include=[])["ids"])
+    new = [(chunk, embedding) for chunk, embedding in zip(chunks, embeddings) if chunk.metadata["id"] not in existing_ids]
+    if new:
+        collection.add(
+            ids=[chunk.metadata["id"] for chunk, _embedding in new],
+            embeddings=[embedding for _chunk, embedding in new],
+            documents=[chunk.page_content for chunk, _embedding in new],
+            metadatas=[chunk.metadata for chunk, _embedding in new],
+        )
+
+def run_kind(kind, pdf_path, page_count, args):
+    timer = StageTimer()
+
+    pages = bench_extraction(timer, pdf_path)
+    document_id, chunk_count = bench_storage_and_indexing(timer, pages, os.path.basename(pdf_path))
+    del pages
+
+    # Cold ingest extracts every page; the warm run re-ingests the same file so
+    # every page is served from the pages stored by the cold run
+    timer.time("ingest", ingest_pdf, pdf_path, os.path.basename(pdf_path), reuse_pages=False, pages=page_count)
+    timer.time("ingest_warm", ingest_pdf, pdf_path, os.path.basename(pdf_path), reuse_pages=True, pages=page_count)
+
+    for _ in range(args.queries):
+        for query in QUERIES:
+            timer.time("query", semantic_search_qa.query_semantic_search, query)
+            timer.time("qa", semantic_search_qa.query_rag, query)
+
+    timer.time("eda", auto_eda.full_eda_batch, [document_id], pages=page_count)
+
+    output_dir = os.path.join("outputs", f"translate-{kind}")
+    os.makedirs(output_dir, exist_ok=True)
+    timer.time(
+        "translate",
+        lambda: asyncio.run(translation.translate_pdf_file(pdf_path, output_dir=output_dir)),
+        pages=page_count,
+    )
+
+    return {"pages": page_count, "chunks": chunk_count, "stages": timer.report()}
+
+# --- Reporting ---
+
+def print_report(results):
+    for kind, result in results["runs"].items():
+        print(f"\n== {kind}: {result['pages']} pages, {result['chunks']} chunks ==")
+        print(f"{'stage':<12} {'calls':>6} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} {'pages/s':>9} {'peak MB*':>9}")
+        for stage, stats in result["stages"].items():
+            pages_per_sec = stats["pages_per_sec"] if stats["pages_per_sec"] is not None else "-"
+            peak = stats["cumulative_peak_rss_mb"] if stats["cumulative_peak_rss_mb"] is not None else "-"
+            print(f"{stage:<12} {stats['calls']:>6} {stats['total_s']:>9} {stats['p50_ms']:>9} "
+                  f"{stats['p95_ms']:>9} {pages_per_sec:>9} {peak:>9}")
+        print("* process peak RSS so far (high-water mark after the stage), not per-stage usage")
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print(f"\n== Compared with {baseline_path} (p50 ratio, <1 is faster) ==")
+    for kind, result in results["runs"].items():
+        base_stages = baseline.get("runs", {}).get(kind, {}).get("stages", {})
+        for stage, stats in result["stages"].items():
+            base = base_stages.get(stage)
+            if base and base["p50_ms"]:
+                print(f"{kind:<8} {stage:<12} {stats['p50_ms'] / base['p50_ms']:>6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the autopdf pipeline on synthetic PDFs.")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--kinds", nargs="+", choices=["digital", "scanned"], default=["digital", "scanned"])
+    parser.add_argument("--queries", type=int, default=3, help="rounds of search/QA queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-uri", help="benchmark against a real MongoDB instead of mongomock")
+    parser.add_argument("--stub-embeddings", action="store_true", help="use a deterministic fake embedding model")
+    parser.add_argument("--output", default=os.path.join("outputs", "benchmarks"), help="directory for JSON results")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    output_dir = os.path.abspath(args.output)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    use_mongo_stand_in(args.mongo_uri)
+    install_stubs(stub_embeddings=args.stub_embeddings)
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "pages": args.pages,
+            "kinds": args.kinds,
+            "queries": args.queries,
+            "seed": args.seed,
+            "mongo": "server" if args.mongo_uri else "mongomock",
+            "stub_embeddings": args.stub_embeddings,
+            "chroma_batch_size": semantic_search_qa.CHROMA_BATCH_SIZE,
+            "page_batch_size": db.PAGE_BATCH_SIZE,
+        },
+        "platform": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "runs": {},
+    }
+
+    # Chroma, EDA and translation write relative to the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="autopdf-bench-") as workdir:
+        os.chdir(workdir)
+        try:
+            digital_path = os.path.join(workdir, "digital.pdf")
+            make_digital_pdf(digital_path, args.pages, seed=args.seed)
+            paths = {"digital": digital_path}
+            if "scanned" in args.kinds:
+                paths["scanned"] = os.path.join(workdir, "scanned.pdf")
+                make_scanned_pdf(digital_path, paths["scanned"])
+
+            for kind in args.kinds:
+                print(f"Benchmarking {kind} PDF ({args.pages} pages)...")
+                results["runs"][kind] = run_kind(kind, paths[kind], args.pages, args)
+        finally:
+            os.chdir(cwd)
+
+    # Stage breakdown recorded by the pipeline's own instrumentation
+    results["metrics"] = metrics.snapshot()
+
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"benchmark-{datetime.utcnow():%Y%m%d-%H%M%S}.json")
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print_report(results)
+    if compare_path:
+        print_comparison(results, compare_path)
+    print(f"\nSaved results to {output_path}")
+
+if __name__ == "__main__":
+    main()
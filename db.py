@@ -1,6 +1,11 @@
 import os
-from pymongo import MongoClient
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient, ASCENDING
 from dotenv import load_dotenv
+from metrics import timed
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,7 +17,245 @@ MONGODB_URI = os.getenv("MONGODB_URI")
 if not MONGODB_URI:
     raise ValueError("MONGODB_URI is not set in the .env file")
 
+# Connection pool settings (optional, fall back to driver-friendly defaults)
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+
 # Connect to MongoDB
-client = MongoClient(MONGODB_URI)
+client = MongoClient(
+    MONGODB_URI,
+    maxPoolSize=MONGODB_MAX_POOL_SIZE,
+    minPoolSize=MONGODB_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+)
 db = client["pdf_mining"]
 collection = db["documents"]
+pages_collection = db["pages"]
+
+# Number of page records buffered before each insert_many during ingest
+PAGE_BATCH_SIZE = int(os.getenv("PAGE_BATCH_SIZE", "16"))
+
+# Fields returned when listing documents (never the page payloads)
+DOCUMENT_SUMMARY_FIELDS = {"filename": 1, "uploaded_at": 1}
+
+def ensure_indexes():
+    """
+    Create the indexes used by listing and lookups. Safe to call repeatedly.
+    """
+    collection.create_index([("filename", ASCENDING)])
+    collection.create_index([("uploaded_at", ASCENDING), ("_id", ASCENDING)])
+    collection.create_index([("content_hash", ASCENDING)], sparse=True)
+    collection.create_index([("alias_of", ASCENDING)], sparse=True)
+    pages_collection.create_index([("document_id", ASCENDING), ("page_number", ASCENDING)], unique=True)
+    pages_collection.create_index([("page_hash", ASCENDING)], sparse=True)
+
+def backfill_upload_times():
+    """
+    Give documents stored before uploaded_at existed the creation time of their id,
+    so every document has a place in the listing order.
+    """
+    for doc in collection.find({"uploaded_at": {"$exists": False}}, {"_id": 1}):
+        uploaded_at = doc["_id"].generation_time.replace(tzinfo=None)
+        collection.update_one({"_id": doc["_id"]}, {"$set": {"uploaded_at": uploaded_at}})
+
+def insert_document(document: dict) -> str:
+    """
+    Insert a document record and return its id as a string.
+    """
+    with timed("mongo.insert_document"):
+        inserted = collection.insert_one(document)
+    return str(inserted.inserted_id)
+
+def insert_alias(document: dict, data_id: str) -> str:
+    """
+    Insert a document record that reuses the pages and embeddings stored under data_id.
+    """
+    record = dict(document)
+    record["alias_of"] = ObjectId(data_id)
+    return insert_document(record)
+
+def complete_document(document_id: str, page_count: int, content_hash: Optional[str] = None):
+    """
+    Record the page count once ingest completes. The content hash is only set
+    at this point so that duplicate lookups never match a half-ingested upload.
+    """
+    update = {"page_count": page_count}
+    if content_hash:
+        update["content_hash"] = content_hash
+    collection.update_one({"_id": ObjectId(document_id)}, {"$set": update})
+
+def find_by_content_hash(content_hash: str) -> Optional[dict]:
+    """
+    Find a stored upload with the same bytes. Returns its id, the id its data
+    is stored under, and its page count, or None.
+    """
+    doc = collection.find_one({"content_hash": content_hash}, {"alias_of": 1, "page_count": 1})
+    if not doc:
+        return None
+    return {
+        "id": str(doc["_id"]),
+        "data_id": str(doc.get("alias_of") or doc["_id"]),
+        "page_count": doc.get("page_count", 0),
+    }
+
+def find_page_by_hash(page_hash: str) -> Optional[dict]:
+    """
+    Fetch a previously extracted page with the same content, without its ids.
+    """
+    with timed("mongo.find_page_by_hash"):
+        return pages_collection.find_one(
+            {"page_hash": page_hash}, {"_id": 0, "document_id": 0, "page_number": 0}
+        )
+
+class PageWriter:
+    """
+    Buffer page records for one document and write them with insert_many in bounded batches.
+    Use as a context manager so the last partial batch is flushed.
+    """
+
+    def __init__(self, document_id: str, batch_size: int = PAGE_BATCH_SIZE):
+        self.document_id = ObjectId(document_id)
+        self.batch_size = batch_size
+        self.page_count = 0
+        self._buffer = []
+
+    def add(self, page: dict):
+        record = dict(page)
+        record["document_id"] = self.document_id
+        self._buffer.append(record)
+        self.page_count += 1
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with timed("mongo.insert_pages"):
+                pages_collection.insert_many(self._buffer, ordered=False)
+            self._buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
+
+def encode_cursor(uploaded_at: datetime, document_id) -> str:
+    """
+    Build the opaque listing cursor for a document: "<upload time in ms>-<id>".
+    """
+    millis = (uploaded_at - datetime(1970, 1, 1)) // timedelta(milliseconds=1)
+    return f"{millis}-{document_id}"
+
+def decode_cursor(cursor: str):
+    """
+    Parse a listing cursor. Raises ValueError if it is malformed.
+    """
+    try:
+        millis, document_id = cursor.split("-", 1)
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(millis)), ObjectId(document_id)
+    except (ValueError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def list_documents(limit: Optional[int] = None, after: Optional[str] = None) -> dict:
+    """
+    List documents without their pages, oldest upload first.
+    Returns {"documents": [...], "next": cursor}; pass `next` back as `after`
+    to continue. `next` is None once the last document has been returned.
+    Raises ValueError for a malformed cursor.
+    """
+    query = {}
+    if after:
+        uploaded_at, last_id = decode_cursor(after)
+        query["$or"] = [
+            {"uploaded_at": {"$gt": uploaded_at}},
+            {"uploaded_at": uploaded_at, "_id": {"$gt": last_id}},
+        ]
+
+    cursor = collection.find(query, DOCUMENT_SUMMARY_FIELDS).sort([("uploaded_at", ASCENDING), ("_id", ASCENDING)])
+    if limit:
+        # One extra document tells us whether there is another page
+        cursor = cursor.limit(limit + 1)
+
+    documents = []
+    next_cursor = None
+    with timed("mongo.list_documents"):
+        for doc in cursor:
+            if limit and len(documents) == limit:
+                next_cursor = encode_cursor(last_doc["uploaded_at"], last_doc["_id"])
+                break
+            last_doc = doc
+            uploaded_at = doc.get("uploaded_at")
+            documents.append({
+                "id": str(doc["_id"]),
+                "filename": doc["filename"],
+                "uploaded_at": uploaded_at.isoformat() if uploaded_at else None,
+            })
+    return {"documents": documents, "next": next_cursor}
+
+def find_existing_ids(document_ids: list) -> set:
+    """
+    Return the subset of the given ids that exist in the database.
+    """
+    docs = collection.find({"_id": {"$in": [ObjectId(doc_id) for doc_id in document_ids]}}, {"_id": 1})
+    return {str(doc["_id"]) for doc in docs}
+
+def get_page_texts(document_id: str) -> Optional[list]:
+    """
+    Fetch only the page texts of a document in page order, or None if it does not exist.
+    """
+    with timed("mongo.get_page_texts"):
+        doc = collection.find_one({"_id": ObjectId(document_id)}, {"pages.text": 1, "alias_of": 1})
+        if not doc:
+            return None
+
+        # Documents stored before the page collection existed keep their pages inline
+        if "pages" in doc:
+            return [page.get("text", "") for page in doc["pages"]]
+
+        cursor = pages_collection.find(
+            {"document_id": doc.get("alias_of") or doc["_id"]}, {"_id": 0, "text": 1}
+        ).sort("page_number", ASCENDING)
+        return [page.get("text", "") for page in cursor]
+
+def delete_document(document_id: str) -> Optional[dict]:
+    """
+    Delete a document record. Returns the deleted record (with alias_of, if any), or None if it did not exist.
+    Pages are left in place; once the record is gone, call promote_alias so another upload
+    takes them over, or release_pages if none does.
+    """
+    with timed("mongo.delete_document"):
+        return collection.find_one_and_delete({"_id": ObjectId(document_id)}, projection={"alias_of": 1})
+
+def promote_alias(data_id: str) -> Optional[str]:
+    """
+    Make the oldest alias of data_id own its pages once the original record is deleted,
+    and point the remaining aliases at it. Returns the new owner's id, or None if there
+    were no aliases.
+    """
+    data_id = ObjectId(data_id)
+    with timed("mongo.promote_alias"):
+        owner = collection.find_one(
+            {"alias_of": data_id}, {"_id": 1}, sort=[("uploaded_at", ASCENDING), ("_id", ASCENDING)]
+        )
+        if not owner:
+            return None
+        owner_id = owner["_id"]
+        pages_collection.update_many({"document_id": data_id}, {"$set": {"document_id": owner_id}})
+        collection.update_one({"_id": owner_id}, {"$unset": {"alias_of": ""}})
+        collection.update_many({"alias_of": data_id}, {"$set": {"alias_of": owner_id}})
+    return str(owner_id)
+
+def release_pages(data_id: str) -> bool:
+    """
+    Delete the pages stored under data_id unless a document or alias still refers to them.
+    Returns True if the pages were deleted.
+    """
+    data_id = ObjectId(data_id)
+    with timed("mongo.release_pages"):
+        if collection.find_one({"$or": [{"_id": data_id}, {"alias_of": data_id}]}, {"_id": 1}):
+            return False
+        pages_collection.delete_many({"document_id": data_id})
+    return True
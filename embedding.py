@@ -8,16 +8,22 @@ def get_embedding_function():
     return embeddings
 """
 
+from functools import lru_cache
 from langchain_huggingface import HuggingFaceEmbeddings
+from metrics import timed_model_load, register_cache
 
+@lru_cache(maxsize=1)
 def get_embedding_function():
     model_name = "BAAI/bge-small-en"
     model_kwargs = {"device": "cpu"}
     encode_kwargs = {"normalize_embeddings": True}
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs=model_kwargs,
-        encode_kwargs=encode_kwargs,
-    )
-    return embeddings
\ No newline at end of file
+    with timed_model_load(f"embedding:{model_name}"):
+        embeddings = HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs=model_kwargs,
+            encode_kwargs=encode_kwargs,
+        )
+    return embeddings
+
+register_cache("embedding_function", get_embedding_function)
\ No newline at end of file
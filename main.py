@@ -1,20 +1,37 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Path
+from fastapi import FastAPI, Request, UploadFile, File, HTTPException, Path, Query
 from fastapi.responses import FileResponse
 from fastapi.responses import JSONResponse
-from pdf_utils import extract_pdf_data
+from pdf_utils import iter_pdf_pages, iter_in_background
 from auto_eda import full_eda_batch
-from bson import ObjectId
-from db import collection
-from models import PDFDocument, SearchRequest, DeleteRequest, QAQuery
-from typing import List
-from semantic_search_qa import split_documents, add_to_chroma, delete_texts_from_chroma, query_semantic_search, query_rag
+from db import ensure_indexes, backfill_upload_times, insert_document, insert_alias, complete_document, find_by_content_hash, find_page_by_hash, PageWriter, list_documents, find_existing_ids, delete_document, promote_alias, release_pages
+from models import PDFDocument, PageData, SearchRequest, DeleteRequest, QAQuery
+from typing import List, Optional
+from semantic_search_qa import CHROMA_BATCH_SIZE, split_documents, add_to_chroma, delete_texts_from_chroma, reassign_chroma_source, query_semantic_search, query_rag
 from langchain.schema import Document
 from translation import translate_pdf_file
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from metrics import track_request, request_name, snapshot, timed, increment
 import os
 
 import tempfile
 import shutil
+import hashlib
+from contextlib import closing
+
+# Read uploads in 1 MiB chunks while hashing them
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# What to do when the same PDF bytes are uploaded again:
+# "alias" creates a new id that shares the stored extraction and embeddings,
+# "existing" returns the id of the earlier upload
+DUPLICATE_UPLOAD_POLICY = os.getenv("DUPLICATE_UPLOAD_POLICY", "alias")
+
+# Extracted pages allowed to wait for storage/embedding while the next ones are extracted
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+
+# Reuse the stored extraction of pages whose content hash matches a page seen before
+REUSE_EXTRACTED_PAGES = os.getenv("REUSE_EXTRACTED_PAGES", "1") == "1"
 
 app = FastAPI()
 
@@ -26,56 +43,122 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    Log per-request stage timings and counters as one structured line.
+    """
+    with track_request(request_name(request.method)) as request_metrics:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        request_metrics.name = request_name(request.method, route.path if route is not None else None)
+        request_metrics.status = response.status_code
+        return response
+
+@app.on_event("startup")
+def create_indexes():
+    ensure_indexes()
+    backfill_upload_times()
+
 @app.post("/upload_pdf/")
 async def upload_pdf(file: UploadFile = File(...)):
     """
     Upload a PDF file, extract its data, and store it in the database.
     """
-    # Create a temporary file to save the uploaded PDF
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
-        shutil.copyfileobj(file.file, temp_file)
+    # Save the uploaded PDF to a temporary file, hashing it on the way
+    sha256 = hashlib.sha256()
+    with timed("ingest.receive"), tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
+        while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+            sha256.update(chunk)
+            temp_file.write(chunk)
         temp_file_path = temp_file.name
+    content_hash = sha256.hexdigest()
 
     try:
-        # Extract data from the PDF file
-        pdf_data = extract_pdf_data(temp_file_path, original_filename=file.filename)
-
-        # Create a PDFDocument instance
-        pdf_document = PDFDocument(**pdf_data)
-
-        # Save to MongoDB
-        inserted = collection.insert_one(pdf_document.dict())
-        inserted_id = str(inserted.inserted_id)
-
-        # Convert each page into a Document (Langchain)
-        docs = []
-        for page in pdf_data["pages"]:
-            if page["text"].strip():
-                metadata = {
-                    "source": inserted_id,
-                    "page": page["page_number"],
-                }
-
-                # Combine all structured info for semantic search
-                text_block = page["text"]
-                if page.get("tables"):
-                    text_block += "\n\n[TABLES]\n" + "\n".join(page["tables"])
-                if page.get("figure_captions"):
-                    text_block += "\n\n[FIGURES]\n" + "\n".join(page["figure_captions"])
-
-                docs.append(Document(text_block, metadata=metadata))
-
-        # Split and store in Chroma
-        chunks = split_documents(docs)
-        add_to_chroma(chunks)
-
-        return JSONResponse(content={"message": "PDF uploaded and data extracted successfully.", "id": str(inserted.inserted_id)}, status_code=200)
+        # Same bytes already ingested: answer from the stored data
+        existing = find_by_content_hash(content_hash)
+        if existing:
+            increment("duplicate_uploads")
+            if DUPLICATE_UPLOAD_POLICY == "existing":
+                return JSONResponse(content={"message": "PDF was already uploaded.", "id": existing["id"]}, status_code=200)
+
+            pdf_document = PDFDocument(filename=file.filename, page_count=existing["page_count"], content_hash=content_hash)
+            alias_id = insert_alias(pdf_document.dict(), existing["data_id"])
+            return JSONResponse(content={"message": "PDF was already uploaded; reusing its extracted data.", "id": alias_id}, status_code=200)
+
+        # Ingest is blocking work; keep it off the event loop
+        inserted_id = await run_in_threadpool(ingest_pdf, temp_file_path, file.filename, content_hash=content_hash)
+        return JSONResponse(content={"message": "PDF uploaded and data extracted successfully.", "id": inserted_id}, status_code=200)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
     finally:
         # Clean up the temporary file
         os.remove(temp_file_path)
 
+def ingest_pdf(file_path: str, filename: str, content_hash: Optional[str] = None,
+               reuse_pages: bool = REUSE_EXTRACTED_PAGES) -> str:
+    """
+    Extract a PDF page by page, storing, chunking and embedding pages as they are produced.
+    With reuse_pages, pages identical to previously stored ones reuse their extraction.
+    Returns the new document id.
+    """
+    inserted_id = None
+    try:
+        # Save the document record first so pages can reference it
+        pdf_document = PDFDocument(filename=filename)
+        inserted_id = insert_document(pdf_document.dict())
+
+        # Store, chunk and embed pages while the next ones are extracted in a producer thread
+        pages = iter_in_background(iter_pdf_pages(file_path, reuse_page=find_page_by_hash if reuse_pages else None), maxsize=INGEST_QUEUE_SIZE)
+        pending_chunks = []
+        with closing(pages), PageWriter(inserted_id) as page_writer:
+            for page in pages:
+                page_writer.add(PageData(**page).dict())
+
+                doc = page_to_document(page, inserted_id)
+                if doc is not None:
+                    pending_chunks.extend(split_documents([doc]))
+                if len(pending_chunks) >= CHROMA_BATCH_SIZE:
+                    with timed("ingest.index"):
+                        add_to_chroma(pending_chunks)
+                    pending_chunks = []
+
+        if pending_chunks:
+            with timed("ingest.index"):
+                add_to_chroma(pending_chunks)
+        complete_document(inserted_id, page_writer.page_count, content_hash)
+        increment("documents_ingested")
+        return inserted_id
+    except Exception:
+        # Don't leave a partially stored document behind
+        if inserted_id:
+            delete_document(inserted_id)
+            release_pages(inserted_id)
+            delete_texts_from_chroma(inserted_id)
+        raise
+
+def page_to_document(page: dict, source_id: str):
+    """
+    Convert an extracted page into a Langchain Document, or None if the page has no text.
+    """
+    if not page["text"].strip():
+        return None
+
+    metadata = {
+        "source": source_id,
+        "page": page["page_number"],
+    }
+
+    # Combine all structured info for semantic search
+    text_block = page["text"]
+    if page.get("tables"):
+        table_lines = [" | ".join(row) for table in page["tables"] for row in table["rows"]]
+        text_block += "\n\n[TABLES]\n" + "\n".join(table_lines)
+    if page.get("figure_captions"):
+        text_block += "\n\n[FIGURES]\n" + "\n".join(page["figure_captions"])
+
+    return Document(text_block, metadata=metadata)
+
 @app.delete("/delete_pdf/")
 async def delete_pdf(request: DeleteRequest):
     """
@@ -83,14 +166,19 @@ async def delete_pdf(request: DeleteRequest):
     """
     try:
         # Step 1: Find and delete from MongoDB
-        doc = collection.find_one({"_id": ObjectId(request.id)})
-        if not doc:
+        deleted = delete_document(request.id)
+        if not deleted:
             return JSONResponse(content={"error": "PDF not found."}, status_code=404)
 
-        collection.delete_one({"_id": ObjectId(request.id)})
-
-        # Step 2: Delete all related pages from ChromaDB
-        delete_texts_from_chroma(request.id)
+        # Step 2: Deleting an alias leaves the shared data in place. Deleting the upload that
+        # owns the data hands it to its oldest alias, so search results keep pointing at a
+        # listed document, or deletes the pages and embeddings if nothing shares them
+        if not deleted.get("alias_of"):
+            new_owner_id = promote_alias(request.id)
+            if new_owner_id:
+                reassign_chroma_source(request.id, new_owner_id)
+            elif release_pages(request.id):
+                delete_texts_from_chroma(request.id)
 
         # Step 3: Delete the folder in the outputs directory
         output_folder_path = os.path.join("outputs", request.id)
@@ -102,13 +190,23 @@ async def delete_pdf(request: DeleteRequest):
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.get("/metrics")
+def get_metrics():
+    """
+    Stage durations, counters, cache hit rates and model load times since startup.
+    """
+    return snapshot()
+
 @app.get("/documents/")
-def get_documents():
+def get_documents(limit: Optional[int] = Query(None, gt=0), after: Optional[str] = None):
     """
-    Retrieve all documents from the database.
+    Retrieve documents from the database (id, filename, upload time only), oldest first.
+    Use `limit` and pass the returned `next` cursor as `after` to page through large collections.
     """
-    docs = collection.find({}, {"filename": 1})
-    return [{"id": str(doc["_id"]), "filename": doc["filename"]} for doc in docs]
+    try:
+        return list_documents(limit=limit, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
 @app.post("/run_batch_eda/")
 async def run_batch_eda(document_ids: List[str]):
@@ -116,8 +214,7 @@ async def run_batch_eda(document_ids: List[str]):
     Run EDA on multiple documents at once.
     """
     # Validate all documents exist first
-    existing_docs = collection.find({"_id": {"$in": [ObjectId(doc_id) for doc_id in document_ids]}})
-    existing_ids = {str(doc["_id"]) for doc in existing_docs}
+    existing_ids = find_existing_ids(document_ids)
     missing_ids = set(document_ids) - existing_ids
 
     if missing_ids:
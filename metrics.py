@@ -0,0 +1,261 @@
+"""
+In-process pipeline metrics: stage durations, counters, cache hit rates and
+model load times, plus a structured timing log line per request and optional
+sampling profiles of slow requests.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Number of recent samples kept per stage for percentiles
+STAGE_SAMPLE_WINDOW = int(os.getenv("METRICS_SAMPLE_WINDOW", "1000"))
+
+# Sampling profiler (opt-in): profile PROFILE_SAMPLE_RATE of requests and keep
+# the profile if the request took longer than SLOW_REQUEST_MS
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_DIR = os.path.join("outputs", "profiles")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger("autopdf.metrics")
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.setLevel(logging.INFO)
+
+_lock = threading.Lock()
+_stages = {}
+_counters = Counter()
+_model_loads = {}
+_caches = {}
+_started_at = time.time()
+
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+class RequestMetrics:
+    """
+    Timings and counters collected while handling one request.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status = None
+        self.stages = Counter()
+        self.counters = Counter()
+        # Threads that have done timed work for this request (sampled by the profiler)
+        self.threads = {threading.get_ident()}
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=STAGE_SAMPLE_WINDOW)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self) -> dict:
+        ordered = sorted(self.recent)
+        return {
+            "count": self.count,
+            "total_s": round(self.total, 4),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else None,
+            "p50_ms": round(_percentile(ordered, 50) * 1000, 3) if ordered else None,
+            "p95_ms": round(_percentile(ordered, 95) * 1000, 3) if ordered else None,
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+def request_name(method: str, route_path=None) -> str:
+    """
+    Name a request by its route template. Unmatched requests share one name so
+    arbitrary paths (404s, scanners) cannot create unbounded stage entries.
+    """
+    return f"{method} {route_path}" if route_path else f"{method} <unmatched>"
+
+def _percentile(ordered, q):
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+# --- Recording ---
+
+def record_stage(stage: str, seconds: float):
+    request = _current_request.get()
+    with _lock:
+        _stages.setdefault(stage, StageStats()).add(seconds)
+        # Ingest records stages from a producer thread too, so update under the lock
+        if request is not None:
+            request.stages[stage] += seconds
+
+@contextmanager
+def timed(stage: str):
+    """
+    Time a block of code as a pipeline stage.
+    """
+    request = _current_request.get()
+    if request is not None:
+        request.threads.add(threading.get_ident())
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def increment(name: str, value: int = 1):
+    """
+    Increment a counter (pages, chunks, cache hits, ...).
+    """
+    request = _current_request.get()
+    with _lock:
+        _counters[name] += value
+        if request is not None:
+            request.counters[name] += value
+
+@contextmanager
+def timed_model_load(name: str):
+    """
+    Time how long a model takes to load.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        with _lock:
+            _model_loads[name] = {"seconds": round(seconds, 3), "loaded_at": datetime.utcnow().isoformat()}
+        record_stage("model_load", seconds)
+
+def register_cache(name: str, cached_function):
+    """
+    Report hits and misses of an lru_cache-wrapped function in the metrics snapshot.
+    """
+    _caches[name] = cached_function
+
+def snapshot() -> dict:
+    """
+    Current metrics as a JSON-serializable dict.
+    """
+    with _lock:
+        stages = {name: stats.summary() for name, stats in sorted(_stages.items())}
+        counters = dict(_counters)
+        model_loads = dict(_model_loads)
+
+    caches = {}
+    for name, cached_function in _caches.items():
+        info = cached_function.cache_info()
+        caches[name] = {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+
+    return {
+        "uptime_s": round(time.time() - _started_at, 1),
+        "stages": stages,
+        "counters": counters,
+        "caches": caches,
+        "model_loads": model_loads,
+    }
+
+# --- Per-request tracking ---
+
+@contextmanager
+def track_request(name: str):
+    """
+    Collect stage timings for one request and log them as a single JSON line when it ends.
+    The name can be refined (e.g. to the matched route) through the yielded object.
+    """
+    request = RequestMetrics(name)
+    token = _current_request.set(request)
+
+    sampler = None
+    if SLOW_REQUEST_MS > 0 and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        sampler = StackSampler(request, PROFILE_INTERVAL_MS / 1000)
+        sampler.start()
+
+    start = time.perf_counter()
+    try:
+        yield request
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _current_request.reset(token)
+        record_stage(f"request {request.name}", duration_ms / 1000)
+
+        profile_path = None
+        if sampler is not None:
+            samples = sampler.stop()
+            if duration_ms >= SLOW_REQUEST_MS:
+                profile_path = save_profile(request.name, samples)
+
+        logger.info(json.dumps({
+            "event": "request",
+            "request": request.name,
+            "status": request.status,
+            "duration_ms": round(duration_ms, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in request.stages.items()},
+            "counters": dict(request.counters),
+            "profile": profile_path,
+        }))
+
+class StackSampler:
+    """
+    Periodically sample the Python stacks of the threads working on one request:
+    the thread that started it and any thread that ran a timed stage for it
+    (thread pool workers, the ingest producer). Only stacks that pass through
+    this project's code are kept. The event loop thread is shared, so async
+    work of concurrent requests can still appear in its samples.
+    """
+
+    def __init__(self, request: RequestMetrics, interval: float):
+        self.request = request
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            thread_ids = set(self.request.threads)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id not in thread_ids:
+                    continue
+                stack = []
+                in_project = False
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    in_project = in_project or code.co_filename.startswith(PROJECT_DIR)
+                    frame = frame.f_back
+                if in_project:
+                    self.samples[";".join(reversed(stack))] += 1
+
+def save_profile(name: str, samples: Counter) -> str:
+    """
+    Write samples in folded-stack format (one "frame;frame;frame count" per line),
+    which flamegraph tools read directly.
+    """
+    if not os.path.exists(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_")
+    path = os.path.join(PROFILE_DIR, f"{datetime.utcnow():%Y%m%d-%H%M%S-%f}-{safe_name}.folded")
+    with open(path, "w") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    return path
@@ -1,18 +1,29 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
+from datetime import datetime
 
 class ImageData(BaseModel):
     format: str
     data: str # Base64 encoded image data
+    caption: Optional[str] = None
+
+class TableData(BaseModel):
+    rows: List[List[str]]
+    bbox: List[float] = []
 
 class PageData(BaseModel):
     page_number: int
     text: Optional[str] = ""
+    tables: List[TableData] = []
+    figure_captions: List[str] = []
     images: List[ImageData] = []
+    page_hash: Optional[str] = None
 
 class PDFDocument(BaseModel):
     filename: str
-    pages: List[PageData]
+    uploaded_at: datetime = Field(default_factory=datetime.utcnow)
+    page_count: int = 0
+    content_hash: Optional[str] = None
 
 class SearchRequest(BaseModel):
     query: str
@@ -1,67 +1,271 @@
 import fitz  # PyMuPDF
 import base64
+import contextvars
+import queue
+import threading
+import bisect
+import hashlib
+import re
 import os
 import io
+import numpy as np
 import pytesseract
 from PIL import Image
+from metrics import timed, increment
+
+# PyMuPDF does not support use from several threads at once. Uploads extract on worker
+# threads and translation runs on the event loop, so every fitz call holds this lock;
+# OCR, storage and embedding run outside it
+FITZ_LOCK = threading.RLock()
+
+# Part of every page hash; bump it when extraction changes so stored pages are not reused
+PAGE_HASH_VERSION = "3"
+
+# An indirect object reference ("12 0 R") in PDF object source
+_PDF_REF = re.compile(r"\b(\d+) (\d+) R\b")
 
 def extract_pdf_data(filepath: str, original_filename: str) -> dict:
-    doc = fitz.open(filepath)
-    pages = []
+    """
+    Extract every page of a PDF at once. Prefer iter_pdf_pages for large files.
+    """
+    return {
+        "filename": original_filename,
+        "pages": list(iter_pdf_pages(filepath)),
+    }
+
+def iter_pdf_pages(filepath: str, reuse_page=None):
+    """
+    Yield one page record at a time so callers can store and embed pages
+    while the rest of the PDF is still being extracted.
+
+    If given, reuse_page(page_hash) should return a previously extracted page
+    with the same content (or None); matching pages are not extracted again.
+    """
+    with FITZ_LOCK:
+        doc = fitz.open(filepath)
+        page_count = doc.page_count
+    try:
+        memo = {}
+        for i in range(page_count):
+            with FITZ_LOCK:
+                page = doc.load_page(i)
+                page_hash = hash_page(doc, page, memo)
+            cached = reuse_page(page_hash) if reuse_page else None
+            if cached:
+                increment("page_cache_hits")
+                page_data = dict(cached, page_number=i + 1)
+            else:
+                page_data = extract_page_data(doc, page, i + 1)
+            page_data["page_hash"] = page_hash
+            yield page_data
+    finally:
+        with FITZ_LOCK:
+            doc.close()
+
+def iter_in_background(iterable, maxsize=4):
+    """
+    Run an iterator in a producer thread and yield its items through a bounded queue,
+    so work done on each item overlaps with producing the next ones. At most
+    `maxsize` items wait in the queue. Errors in the producer are re-raised here.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+        finally:
+            close = getattr(iterable, "close", None)
+            if close:
+                close()
+
+    # Copy the context so per-request metrics still see the producer's stages
+    producer = threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True)
+    producer.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
 
-    for i, page in enumerate(doc):
-        # 1. Native text extraction
+def hash_page(doc, page, memo=None) -> str:
+    """
+    Hash what a page draws: its size, rotation, content stream and every object its
+    resources reference (fonts, images, form XObjects and their own resources), plus
+    its annotations (comments, stamps, form fields) and their appearance streams.
+    Object numbers are replaced by the hash of the object they point to, so identical
+    pages in different files (e.g. a revised edition) get the same hash.
+    Pass the same memo dict for all pages of a document to hash shared objects once.
+    """
+    memo = {} if memo is None else memo
+    with timed("ingest.hash_page"):
+        sha256 = hashlib.sha256(PAGE_HASH_VERSION.encode())
+        sha256.update(f"{tuple(page.rect)}:{page.rotation}".encode())
+        sha256.update(page.read_contents())
+        sha256.update(_hash_refs(doc, _page_resources(doc, page.xref), memo, set()).encode())
+        kind, annots = doc.xref_get_key(page.xref, "Annots")
+        if kind != "null":
+            sha256.update(_hash_refs(doc, annots, memo, set()).encode())
+        return sha256.hexdigest()
+
+def _page_resources(doc, xref) -> str:
+    """
+    Source of a page's /Resources entry, inherited from the page tree if the page has none.
+    """
+    seen = set()
+    while xref and xref not in seen:
+        seen.add(xref)
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return value
+        kind, value = doc.xref_get_key(xref, "Parent")
+        xref = int(value.split()[0]) if kind == "xref" else 0
+    return ""
+
+def _hash_refs(doc, source: str, memo: dict, active: set) -> str:
+    """
+    Replace each "N G R" reference in a PDF object source with the hash of the referenced object.
+    """
+    return _PDF_REF.sub(lambda m: _hash_object(doc, int(m.group(1)), memo, active), source)
+
+def _hash_object(doc, xref: int, memo: dict, active: set) -> str:
+    if xref in memo:
+        return memo[xref]
+    if xref in active or not 0 < xref < doc.xref_length():
+        # Reference cycle or dangling reference: only its position contributes
+        return "ref"
+    if doc.xref_get_key(xref, "Type")[1] in ("/Page", "/Pages"):
+        # Annotations point back at their page (/P); following it would pull in the whole document
+        return "page"
+
+    active.add(xref)
+    try:
+        sha256 = hashlib.sha256(_hash_refs(doc, doc.xref_object(xref, compressed=True), memo, active).encode())
+        if doc.xref_is_stream(xref):
+            sha256.update(doc.xref_stream_raw(xref) or b"")
+    finally:
+        active.discard(xref)
+    memo[xref] = sha256.hexdigest()
+    return memo[xref]
+
+def extract_page_data(doc, page, page_number: int) -> dict:
+    """
+    Extract text, OCR output, tables, images and figure captions from a single page.
+    """
+    # 1. Native text extraction
+    with timed("ingest.native_text"), FITZ_LOCK:
         native_text = page.get_text().strip()
 
-        # 2. Render page as image for OCR
-        ocr_image = render_page_as_image(page)
-        
-        # 3. OCR full text
+    # 2. Render page as image for OCR
+    zoom = 2
+    with timed("ingest.render"), FITZ_LOCK:
+        ocr_image = render_page_as_image(page, zoom=zoom)
+
+    # 3. OCR full text
+    with timed("ingest.ocr"):
         ocr_text = pytesseract.image_to_string(ocr_image).strip()
 
-        # 4. Table detection via OCR layout
-        layout_data = pytesseract.image_to_data(ocr_image, output_type=pytesseract.Output.DICT)
-        table_text_blocks = extract_table_blocks(layout_data)
+    # 4. Table detection from word geometry (OCR layout for pages that are mostly scanned)
+    with timed("ingest.tables"):
+        tables = extract_page_tables(page, ocr_image, zoom=zoom, ocr_text=ocr_text)
 
-        # 5. Extract embedded images and nearby figure captions
-        images = []
-        figure_captions = []
-        for img in page.get_images(full=True):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_format = base_image["ext"]
-            encoded_image = base64.b64encode(image_bytes).decode("utf-8")
-            images.append({"format": image_format, "data": encoded_image})
-
-            # Rough approximation of figure captions: text below image bbox
-            img_rect = fitz.Rect(img[1], img[2], img[3], img[4])  # get image rectangle
-            caption_candidates = page.get_text("blocks")
-            for block in caption_candidates:
-                b_x0, b_y0, b_x1, b_y1, text = block[:5]
-                if text.strip().lower().startswith("figure") and b_y0 > img_rect.y1:
-                    figure_captions.append(text.strip())
-                    break
-
-        # 6. Combine text
+    # 5. Extract embedded images and nearby figure captions
+    with timed("ingest.images"), FITZ_LOCK:
+        images, figure_captions = extract_images_with_captions(doc, page)
+
+    # 6. Combine text
+    with timed("ingest.merge"):
         combined_text = merge_text(native_text, ocr_text)
 
-        pages.append({
-            "page_number": i + 1,
-            "text": combined_text,
-            "native_text": native_text,
-            "ocr_text": ocr_text,
-            "tables": table_text_blocks,
-            "figure_captions": figure_captions,
-            "images": images,
-        })
-
-    doc.close()
+    increment("pages_extracted")
+    increment("tables_extracted", len(tables))
+    increment("images_extracted", len(images))
+
     return {
-        "filename": original_filename,
-        "pages": pages,
+        "page_number": page_number,
+        "text": combined_text,
+        "native_text": native_text,
+        "ocr_text": ocr_text,
+        "tables": tables,
+        "figure_captions": figure_captions,
+        "images": images,
     }
 
+def extract_images_with_captions(doc, page, max_caption_gap=36):
+    """
+    Extract every image drawn on the page and attach "Figure ..." captions.
+    A caption must start at most `max_caption_gap` points below an image and
+    overlap it horizontally; the closest image/caption pairs are matched first
+    and each caption is used once. An image drawn twice yields two records.
+    """
+    # Caption candidates, fetched once per page and sorted by top edge
+    captions = sorted(
+        (block[1], block[0], block[2], block[4].strip())
+        for block in page.get_text("blocks")
+        if block[4].strip().lower().startswith("figure")
+    )
+    caption_tops = [caption[0] for caption in captions]
+    used = set()
+
+    # Where each image is actually drawn; xref 0 is an inline image we cannot extract
+    placements = [info for info in page.get_image_info(xrefs=True) if info["xref"]]
+
+    # Candidate (gap, image, caption) pairs, found by bisecting on caption tops
+    candidates = []
+    for index, info in enumerate(placements):
+        img_rect = fitz.Rect(info["bbox"])
+        start = bisect.bisect_right(caption_tops, img_rect.y1)
+        end = bisect.bisect_right(caption_tops, img_rect.y1 + max_caption_gap)
+        for caption_index in range(start, end):
+            top, c_x0, c_x1, _text = captions[caption_index]
+            if c_x0 < img_rect.x1 and c_x1 > img_rect.x0:
+                candidates.append((top - img_rect.y1, index, caption_index))
+
+    # Closest pairs first; each image and each caption is matched at most once
+    matched = {}
+    for _gap, index, caption_index in sorted(candidates):
+        if index not in matched and caption_index not in used:
+            used.add(caption_index)
+            matched[index] = captions[caption_index][3]
+
+    encoded = {}
+    images = []
+    figure_captions = []
+    for index, info in enumerate(placements):
+        xref = info["xref"]
+        if xref not in encoded:
+            base_image = doc.extract_image(xref)
+            encoded[xref] = (base_image["ext"], base64.b64encode(base_image["image"]).decode("utf-8"))
+        image_format, encoded_image = encoded[xref]
+
+        caption = matched.get(index)
+        if caption:
+            figure_captions.append(caption)
+        images.append({"format": image_format, "data": encoded_image, "caption": caption})
+
+    return images, figure_captions
+
 def render_page_as_image(page, zoom=2):
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat)
@@ -75,26 +279,180 @@ def merge_text(native_text: str, ocr_text: str) -> str:
         return ocr_text
     return f"{native_text}\n\n[OCR Supplement]\n{ocr_text}"
 
-def extract_table_blocks(data) -> list:
+def extract_page_tables(page, ocr_image, zoom=2, ocr_text="", native_word_share=0.5) -> list:
+    """
+    Extract tables from the native text layer, or from OCR layout when the native layer
+    holds fewer than `native_word_share` of the words OCR found in `ocr_text`.
+    Scanned pages often carry a few native words (a footer, Bates number or stamp)
+    that must not hide the tables in the scanned image.
+    """
+    with FITZ_LOCK:
+        words = page.get_text("words")
+    if words and len(words) >= native_word_share * len(ocr_text.split()):
+        with FITZ_LOCK:
+            rule_ys = horizontal_rule_positions(page)
+        boxes = np.array([word[:4] for word in words], dtype=float)
+        texts = [word[4] for word in words]
+        blocks = np.array([word[5] for word in words])
+    else:
+        increment("ocr_layout_fallbacks")
+        layout_data = pytesseract.image_to_data(ocr_image, output_type=pytesseract.Output.DICT)
+        boxes, texts, blocks = ocr_word_boxes(layout_data, zoom=zoom)
+        rule_ys = np.empty(0)
+    return extract_tables(boxes, texts, rule_ys, blocks=blocks)
+
+def ocr_word_boxes(data, zoom=2, min_conf=60):
     """
-    Group OCR text into table-like structures based on bounding box alignment.
+    Convert Tesseract layout output into word boxes in page coordinates,
+    with the text block each word belongs to.
     """
-    n_boxes = len(data['text'])
+    boxes = []
+    texts = []
+    blocks = []
+    for i, text in enumerate(data['text']):
+        if text.strip() and float(data['conf'][i]) > min_conf:
+            x0, y0 = data['left'][i], data['top'][i]
+            boxes.append((x0, y0, x0 + data['width'][i], y0 + data['height'][i]))
+            texts.append(text)
+            blocks.append(data['block_num'][i])
+    if not boxes:
+        return np.empty((0, 4)), texts, np.empty(0)
+    return np.array(boxes, dtype=float) / zoom, texts, np.array(blocks)
+
+def horizontal_rule_positions(page, max_thickness=2.0):
+    """
+    Return the sorted y positions of horizontal lines drawn on the page (table rules).
+    """
+    ys = []
+    for drawing in page.get_drawings():
+        for item in drawing["items"]:
+            if item[0] == "l" and abs(item[1].y - item[2].y) <= max_thickness:
+                ys.append((item[1].y + item[2].y) / 2)
+            elif item[0] == "re" and item[1].height <= max_thickness:
+                ys.append((item[1].y0 + item[1].y1) / 2)
+    return np.sort(np.array(ys, dtype=float))
+
+def extract_tables(boxes, texts, rule_ys=None, blocks=None, min_rows=2, min_cols=2, max_row_gap=1.5) -> list:
+    """
+    Group word boxes into structured tables.
+
+    Words are clustered into rows by vertical centre (drawn rules also break rows),
+    split into cells on wide horizontal gaps, and runs of consecutive multi-cell
+    rows no more than `max_row_gap` line heights apart become table candidates
+    whose columns are the merged x-extents of their cells. `blocks` gives the text
+    block of each word and lets build_table reject columns of flowing text.
+    Returns a list of {"rows": [[cell, ...], ...], "bbox": [x0, y0, x1, y1]}.
+    """
+    if len(texts) == 0:
+        return []
+    if rule_ys is None:
+        rule_ys = np.empty(0)
+
+    heights = boxes[:, 3] - boxes[:, 1]
+    line_height = float(np.median(heights)) or 1.0
+
+    # Rows: sort by vertical centre and break on large jumps or a rule in between
+    centres = (boxes[:, 1] + boxes[:, 3]) / 2
+    order = np.argsort(centres, kind="stable")
+    sorted_centres = centres[order]
+    breaks = np.diff(sorted_centres) > line_height / 2
+    if len(rule_ys):
+        breaks |= np.diff(np.searchsorted(rule_ys, sorted_centres)) != 0
+    row_ids = np.concatenate(([0], np.cumsum(breaks)))
+    row_starts = np.flatnonzero(np.concatenate(([True], np.diff(row_ids) != 0)))
+    row_ends = np.append(row_starts[1:], len(order))
+
+    # Cells: within a row, split on horizontal gaps wider than a line height
     rows = []
-    current_row = []
-    last_top = -1
-
-    for i in range(n_boxes):
-        if int(data['conf'][i]) > 60:
-            top = data['top'][i]
-            if last_top == -1 or abs(top - last_top) < 10:
-                current_row.append(data['text'][i])
-                last_top = top
-            else:
-                if current_row:
-                    rows.append(" | ".join(current_row))
-                current_row = [data['text'][i]]
-                last_top = top
-    if current_row:
-        rows.append(" | ".join(current_row))
-    return rows
+    for start, end in zip(row_starts, row_ends):
+        idx = order[start:end]
+        idx = idx[np.argsort(boxes[idx, 0], kind="stable")]
+        gaps = boxes[idx[1:], 0] - boxes[idx[:-1], 2]
+        cell_starts = np.concatenate(([0], np.flatnonzero(gaps > line_height) + 1))
+        cell_ends = np.append(cell_starts[1:], len(idx))
+        cells = []
+        for c_start, c_end in zip(cell_starts, cell_ends):
+            cell_idx = idx[c_start:c_end]
+            cells.append((
+                boxes[cell_idx, 0].min(),
+                boxes[cell_idx, 2].max(),
+                " ".join(texts[i] for i in cell_idx),
+                frozenset(blocks[cell_idx].tolist()) if blocks is not None and len(blocks) else frozenset(),
+            ))
+        rows.append((idx, cells))
+
+    # Tables: runs of nearby consecutive rows that have at least two cells
+    tables = []
+
+    def close_run(run):
+        if len(run) >= min_rows:
+            table = build_table(boxes, run, min_cols)
+            if table:
+                tables.append(table)
+
+    run = []
+    previous_bottom = None
+    for idx, cells in rows:
+        top = boxes[idx, 1].min()
+        if previous_bottom is not None and top - previous_bottom > max_row_gap * line_height:
+            close_run(run)
+            run = []
+        if len(cells) >= 2:
+            run.append((idx, cells))
+        else:
+            close_run(run)
+            run = []
+        previous_bottom = boxes[idx, 3].max()
+    close_run(run)
+    return tables
+
+def build_table(boxes, run, min_cols=2, prose_words=6):
+    """
+    Align the cells of consecutive rows into columns and return a structured table,
+    or None if the candidate looks like prose rather than a table: most cells are
+    sentences of `prose_words` or more words, or a column is one text block flowing
+    down the whole candidate (a column gutter, as in two-column layouts).
+    """
+    all_cells = [cell for _idx, cells in run for cell in cells]
+    prose_cells = sum(1 for cell in all_cells if len(cell[2].split()) >= prose_words)
+    if prose_cells * 2 > len(all_cells):
+        return None
+
+    cell_x0 = np.array([cell[0] for cell in all_cells])
+    cell_x1 = np.array([cell[1] for cell in all_cells])
+
+    # Columns are the union of overlapping cell extents
+    order = np.argsort(cell_x0, kind="stable")
+    reach = np.maximum.accumulate(cell_x1[order])
+    new_column = np.concatenate(([True], cell_x0[order][1:] > reach[:-1]))
+    column_starts = cell_x0[order][new_column]
+    if len(column_starts) < min_cols:
+        return None
+
+    table_rows = []
+    column_blocks = [[] for _ in column_starts]
+    for _idx, cells in run:
+        row = [""] * len(column_starts)
+        columns = np.searchsorted(column_starts, [cell[0] for cell in cells], side="right") - 1
+        for column, cell in zip(columns, cells):
+            row[column] = f"{row[column]} {cell[2]}".strip()
+            column_blocks[column].append(cell[3])
+        table_rows.append(row)
+
+    # A column filled in every row by a single block that no other column uses
+    # is a column of running text, not table cells
+    for column, block_sets in enumerate(column_blocks):
+        blocks_here = frozenset().union(*block_sets)
+        if len(block_sets) == len(run) and len(blocks_here) == 1:
+            elsewhere = frozenset().union(*(b for other, sets in enumerate(column_blocks) if other != column for b in sets))
+            if not blocks_here & elsewhere:
+                return None
+
+    word_idx = np.concatenate([idx for idx, _cells in run])
+    bbox = [
+        float(boxes[word_idx, 0].min()),
+        float(boxes[word_idx, 1].min()),
+        float(boxes[word_idx, 2].max()),
+        float(boxes[word_idx, 3].max()),
+    ]
+    return {"rows": table_rows, "bbox": bbox}
@@ -7,14 +7,20 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from embedding import get_embedding_function
 from langchain.prompts import ChatPromptTemplate
 from gpt4all import GPT4All
+from metrics import timed, timed_model_load, increment
 import os
 
 # --- Initialize Models and Database ---
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-qa_pipeline = pipeline("question-answering", model="deepset/roberta-base-squad2")
+with timed_model_load("sentence_transformer:all-MiniLM-L6-v2"):
+    embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+with timed_model_load("qa:deepset/roberta-base-squad2"):
+    qa_pipeline = pipeline("question-answering", model="deepset/roberta-base-squad2")
 
 CHROMA_PATH = "chroma"
 
+# Number of chunks embedded and written to Chroma at a time during ingest
+CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", "256"))
+
 PROMPT_TEMPLATE = """
 Answer the question based only on the following context:
 
@@ -36,7 +42,10 @@ def split_documents(documents: list[Document]):
         length_function=len,
         is_separator_regex=False,
     )
-    return text_splitter.split_documents(documents)
+    with timed("ingest.chunk"):
+        chunks = text_splitter.split_documents(documents)
+    increment("chunks_created", len(chunks))
+    return chunks
 
 def add_to_chroma(chunks: list[Document]):
     """
@@ -50,10 +59,11 @@ def add_to_chroma(chunks: list[Document]):
     # calculate Page IDs for each chunk
     chunks_with_ids = calculate_chunk_ids(chunks)
 
-    # add/update documents
-    existing_items = db.get(include=[])
+    # add/update documents (only look up the ids we are about to write)
+    with timed("chroma.lookup"):
+        existing_items = db.get(ids=[chunk.metadata["id"] for chunk in chunks_with_ids], include=[])
     existing_ids = set(existing_items["ids"])
-    print(f"Number of existing documents in DB: {len(existing_ids)}")
+    print(f"Number of chunks already in DB: {len(existing_ids)}")
 
     # add documents that don't exist in DB
     new_chunks = []
@@ -64,7 +74,9 @@ def add_to_chroma(chunks: list[Document]):
     if len(new_chunks):
         print(f"Adding {len(new_chunks)} new chunks to DB.")
         new_chunks_ids = [chunk.metadata["id"] for chunk in new_chunks]
-        db.add_documents(new_chunks, ids=new_chunks_ids)
+        with timed("chroma.embed_and_store"):
+            db.add_documents(new_chunks, ids=new_chunks_ids)
+        increment("chunks_indexed", len(new_chunks))
     else:
         print("No new chunks to add.")
 
@@ -118,13 +130,37 @@ def delete_texts_from_chroma(source_id: str):
     else:
         print(f"No documents found for source ID: {source_id}")
 
+def reassign_chroma_source(old_source_id: str, new_source_id: str):
+    """
+    Point the chunks stored for one document at another document id, keeping their embeddings.
+    """
+    db = Chroma(
+        persist_directory=CHROMA_PATH,
+        embedding_function=get_embedding_function(),
+    )
+
+    with timed("chroma.reassign_source"):
+        existing_items = db.get(where={"source": old_source_id}, include=["metadatas"])
+        if not existing_items["ids"]:
+            return
+
+        metadatas = []
+        for metadata in existing_items["metadatas"]:
+            metadata = dict(metadata, source=new_source_id)
+            if metadata.get("id", "").startswith(f"{old_source_id}:"):
+                metadata["id"] = new_source_id + metadata["id"][len(old_source_id):]
+            metadatas.append(metadata)
+        # Chroma ids stay as they are; results report the source and id from metadata
+        db._collection.update(ids=existing_items["ids"], metadatas=metadatas)
+
 def query_semantic_search(query_text: str):
     # Prepare the DB.
     embedding_function = get_embedding_function()
     db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
 
     # Search the DB.
-    results = db.similarity_search_with_score(query_text, k=5)
+    with timed("search.query"):
+        results = db.similarity_search_with_score(query_text, k=5)
 
     # Organize results
     structured_results = []
@@ -146,15 +182,18 @@ def query_rag(query_text: str):
     db = Chroma(persist_directory=CHROMA_PATH, embedding_function=embedding_function)
 
     # Search the DB.
-    results = db.similarity_search_with_score(query_text, k=3)
+    with timed("qa.retrieve"):
+        results = db.similarity_search_with_score(query_text, k=3)
 
     context_text = "\n\n---\n\n".join([doc.page_content for doc, _score in results])
     prompt_template = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
     prompt = prompt_template.format(context=context_text, question=query_text)
     # print(prompt)
 
-    model = GPT4All("mistral-7b-openorca.gguf2.Q4_0.gguf")  # model downloaded on first run
-    response_text = model.generate(prompt)
+    with timed_model_load("llm:mistral-7b-openorca"):
+        model = GPT4All("mistral-7b-openorca.gguf2.Q4_0.gguf")  # model downloaded on first run
+    with timed("qa.generate"):
+        response_text = model.generate(prompt)
 
     sources = [doc.metadata.get("id", None) for doc, _score in results]
     formatted_response = f"Response: {response_text}\nSources: {sources}"
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# db.py needs a URI at import time; tests swap in mongomock collections
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
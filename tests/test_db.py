@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+
+import db
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = mongomock.MongoClient()
+    database = client["pdf_mining_test"]
+    monkeypatch.setattr(db, "collection", database["documents"])
+    monkeypatch.setattr(db, "pages_collection", database["pages"])
+    db.ensure_indexes()
+    return database
+
+
+def insert_documents(count, uploaded_at=None):
+    start = datetime(2024, 1, 1)
+    return [
+        db.insert_document({
+            "filename": f"report-{i}.pdf",
+            "uploaded_at": uploaded_at or start + timedelta(minutes=i),
+        })
+        for i in range(count)
+    ]
+
+
+def test_list_documents_pages_through_everything_once(mongo):
+    ids = insert_documents(5)
+
+    seen = []
+    after = None
+    while True:
+        page = db.list_documents(limit=2, after=after)
+        seen.extend(doc["id"] for doc in page["documents"])
+        after = page["next"]
+        if after is None:
+            break
+
+    assert seen == ids
+
+
+def test_list_documents_breaks_upload_time_ties_by_id(mongo):
+    ids = insert_documents(3, uploaded_at=datetime(2024, 1, 1))
+
+    first = db.list_documents(limit=2)
+    rest = db.list_documents(limit=2, after=first["next"])
+
+    assert [doc["id"] for doc in first["documents"]] == ids[:2]
+    assert [doc["id"] for doc in rest["documents"]] == ids[2:]
+    assert rest["next"] is None
+
+
+def test_list_documents_without_limit_has_no_next(mongo):
+    insert_documents(3)
+    assert db.list_documents()["next"] is None
+
+
+@pytest.mark.parametrize("cursor", ["not-an-id", "123", "abc-5f0000000000000000000000"])
+def test_list_documents_rejects_malformed_cursor(mongo, cursor):
+    with pytest.raises(ValueError):
+        db.list_documents(limit=2, after=cursor)
+
+
+def test_backfill_upload_times_uses_id_creation_time(mongo):
+    document_id = db.collection.insert_one({"filename": "legacy.pdf"}).inserted_id
+
+    db.backfill_upload_times()
+
+    assert db.list_documents()["documents"][0]["uploaded_at"] is not None
+    assert db.collection.find_one({"_id": document_id})["uploaded_at"] == document_id.generation_time.replace(tzinfo=None)
+
+
+def store_pages(document_id, texts):
+    with db.PageWriter(document_id) as writer:
+        for i, text in enumerate(texts):
+            writer.add({"page_number": i + 1, "text": text})
+
+
+def test_deleting_original_hands_pages_to_oldest_alias(mongo):
+    original, = insert_documents(1)
+    store_pages(original, ["first page", "second page"])
+    start = datetime(2024, 2, 1)
+    first_alias = db.insert_alias({"filename": "copy-1.pdf", "uploaded_at": start}, original)
+    second_alias = db.insert_alias({"filename": "copy-2.pdf", "uploaded_at": start + timedelta(minutes=1)}, original)
+
+    db.delete_document(original)
+    assert db.promote_alias(original) == first_alias
+
+    assert db.get_page_texts(first_alias) == ["first page", "second page"]
+    assert db.get_page_texts(second_alias) == ["first page", "second page"]
+    assert "alias_of" not in db.collection.find_one({"_id": db.ObjectId(first_alias)})
+    # The pages now belong to a listed document, so they are not released
+    assert not db.release_pages(first_alias)
+    assert {doc["id"] for doc in db.list_documents()["documents"]} == {first_alias, second_alias}
+
+
+def test_deleting_unshared_document_releases_its_pages(mongo):
+    original, = insert_documents(1)
+    store_pages(original, ["only page"])
+
+    db.delete_document(original)
+
+    assert db.promote_alias(original) is None
+    assert db.release_pages(original)
+    assert db.pages_collection.count_documents({}) == 0
+
+
+def test_deleting_alias_keeps_shared_pages(mongo):
+    original, = insert_documents(1)
+    store_pages(original, ["only page"])
+    alias = db.insert_alias({"filename": "copy.pdf", "uploaded_at": datetime(2024, 2, 1)}, original)
+
+    assert db.delete_document(alias)["alias_of"] == db.ObjectId(original)
+
+    assert db.get_page_texts(original) == ["only page"]
@@ -0,0 +1,81 @@
+import contextvars
+import threading
+import time
+
+import metrics
+
+
+def test_percentile_uses_nearest_rank():
+    ordered = list(range(1, 101))
+    assert metrics._percentile(ordered, 50) == 50
+    assert metrics._percentile(ordered, 95) == 95
+    assert metrics._percentile([7], 95) == 7
+
+
+def test_stage_stats_summary():
+    stats = metrics.StageStats()
+    for seconds in [0.004, 0.001, 0.003, 0.002]:
+        stats.add(seconds)
+
+    summary = stats.summary()
+
+    assert summary["count"] == 4
+    assert summary["total_s"] == 0.01
+    assert summary["mean_ms"] == 2.5
+    assert summary["p50_ms"] == 2.0
+    assert summary["p95_ms"] == 4.0
+    assert summary["max_ms"] == 4.0
+
+
+def test_stage_stats_keeps_bounded_window_but_full_totals():
+    stats = metrics.StageStats()
+    for _ in range(metrics.STAGE_SAMPLE_WINDOW + 10):
+        stats.add(0.001)
+
+    assert len(stats.recent) == metrics.STAGE_SAMPLE_WINDOW
+    assert stats.summary()["count"] == metrics.STAGE_SAMPLE_WINDOW + 10
+
+
+def test_unmatched_requests_share_one_name():
+    assert metrics.request_name("GET", "/documents/") == "GET /documents/"
+    assert metrics.request_name("GET") == metrics.request_name("GET", None) == "GET <unmatched>"
+
+
+def test_request_collects_stages_from_worker_threads():
+    with metrics.track_request("GET /test") as request:
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(record_stage_in_worker,))
+        worker.start()
+        worker.join()
+
+    assert request.stages["test.worker"] > 0
+    assert worker.ident in request.threads
+
+
+def record_stage_in_worker():
+    with metrics.timed("test.worker"):
+        time.sleep(0.001)
+
+
+def test_sampler_only_samples_request_threads():
+    busy = threading.Event()
+    stop = threading.Event()
+
+    def other_request():
+        busy.set()
+        while not stop.is_set():
+            sum(range(1000))
+
+    other = threading.Thread(target=other_request)
+    other.start()
+    busy.wait()
+
+    request = metrics.RequestMetrics("GET /test")
+    sampler = metrics.StackSampler(request, interval=0.001)
+    sampler.start()
+    time.sleep(0.05)
+    samples = sampler.stop()
+    stop.set()
+    other.join()
+
+    assert not any("other_request" in stack for stack in samples)
+    assert any("test_sampler_only_samples_request_threads" in stack for stack in samples)
@@ -0,0 +1,289 @@
+import threading
+import time
+
+import fitz
+import numpy as np
+import pytest
+
+import pdf_utils
+
+
+def test_iter_in_background_yields_items_in_order():
+    assert list(pdf_utils.iter_in_background(iter(range(10)), maxsize=2)) == list(range(10))
+
+
+def test_iter_in_background_reraises_producer_errors():
+    def failing():
+        yield 1
+        raise RuntimeError("extraction failed")
+
+    items = pdf_utils.iter_in_background(failing(), maxsize=2)
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="extraction failed"):
+        next(items)
+
+
+def test_iter_in_background_stays_bounded_and_stops_when_closed():
+    produced = []
+    closed = threading.Event()
+
+    def pages():
+        try:
+            for i in range(100):
+                produced.append(i)
+                yield i
+        finally:
+            closed.set()
+
+    items = pdf_utils.iter_in_background(pages(), maxsize=2)
+    assert next(items) == 0
+    time.sleep(0.3)
+    # One item consumed, two queued, one waiting to be queued
+    assert len(produced) <= 4
+
+    items.close()
+    assert closed.wait(1)
+    assert len(produced) <= 4
+
+
+def solid_pixmap(color=(200, 30, 30)):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 16, 16), False)
+    pix.set_rect(pix.irect, color)
+    return pix
+
+
+def test_captions_follow_each_placement_of_a_repeated_image():
+    doc = fitz.open()
+    page = doc.new_page()
+    xref = page.insert_image(fitz.Rect(72, 72, 272, 172), pixmap=solid_pixmap())
+    page.insert_text((72, 190), "Figure 1: a", fontsize=10)
+    page.insert_image(fitz.Rect(72, 300, 272, 400), xref=xref)
+    page.insert_text((72, 418), "Figure 2: b", fontsize=10)
+
+    images, captions = pdf_utils.extract_images_with_captions(doc, page)
+
+    assert sorted(image["caption"] for image in images) == ["Figure 1: a", "Figure 2: b"]
+    assert sorted(captions) == ["Figure 1: a", "Figure 2: b"]
+
+
+def test_caption_is_used_by_only_one_image():
+    doc = fitz.open()
+    page = doc.new_page()
+    # Both images end within reach of the caption; the lower one is closer
+    page.insert_image(fitz.Rect(72, 72, 272, 180), pixmap=solid_pixmap())
+    page.insert_image(fitz.Rect(72, 182, 272, 200), pixmap=solid_pixmap((0, 0, 200)))
+    page.insert_text((72, 220), "Figure 1: only one", fontsize=10)
+
+    images, captions = pdf_utils.extract_images_with_captions(doc, page)
+
+    assert [image["caption"] for image in images] == [None, "Figure 1: only one"]
+    assert captions == ["Figure 1: only one"]
+
+
+def test_distant_caption_is_not_attached():
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(72, 72, 272, 172), pixmap=solid_pixmap())
+    page.insert_text((72, 400), "Figure 9: far away", fontsize=10)
+
+    images, captions = pdf_utils.extract_images_with_captions(doc, page)
+
+    assert images[0]["caption"] is None
+    assert captions == []
+
+
+def page_words(page):
+    words = page.get_text("words")
+    boxes = np.array([word[:4] for word in words], dtype=float)
+    return boxes, [word[4] for word in words], np.array([word[5] for word in words])
+
+
+def draw_ruled_table(page, top=100, rows=5):
+    y = top
+    for _ in range(rows):
+        for x, cell in zip([72, 200, 320, 440], ["Region", "1234", "5.5%", "77"]):
+            page.insert_text((x, y), cell, fontsize=10)
+        page.draw_line((72, y + 4), (540, y + 4), width=0.5)
+        y += 18
+
+
+def test_extract_tables_finds_ruled_table():
+    page = fitz.open().new_page()
+    draw_ruled_table(page)
+    boxes, texts, blocks = page_words(page)
+
+    tables = pdf_utils.extract_tables(boxes, texts, pdf_utils.horizontal_rule_positions(page), blocks=blocks)
+
+    assert len(tables) == 1
+    assert tables[0]["rows"] == [["Region", "1234", "5.5%", "77"]] * 5
+
+
+def test_extract_tables_ignores_two_column_prose():
+    prose = ("The agency reviewed the regional budget and found that program growth "
+             "exceeded the estimate in most districts surveyed during the fiscal year. ") * 6
+    page = fitz.open().new_page()
+    page.insert_textbox(fitz.Rect(72, 72, 290, 700), prose, fontsize=10)
+    page.insert_textbox(fitz.Rect(320, 72, 540, 700), prose, fontsize=10)
+    boxes, texts, blocks = page_words(page)
+
+    assert pdf_utils.extract_tables(boxes, texts, blocks=blocks) == []
+
+
+def test_extract_tables_ignores_two_columns_of_short_lines():
+    lines = "\n".join(["budget rate", "the survey", "growth here", "more data"] * 5)
+    page = fitz.open().new_page()
+    page.insert_textbox(fitz.Rect(72, 72, 290, 700), lines, fontsize=10)
+    page.insert_textbox(fitz.Rect(320, 72, 540, 700), lines, fontsize=10)
+    boxes, texts, blocks = page_words(page)
+
+    assert pdf_utils.extract_tables(boxes, texts, blocks=blocks) == []
+
+
+def test_extract_tables_does_not_join_distant_rows():
+    doc = fitz.open()
+    page = doc.new_page()
+    draw_ruled_table(page)
+    page.insert_image(fitz.Rect(72, 200, 272, 300), pixmap=solid_pixmap())
+    page.insert_text((72, 330), "Figure 1: left", fontsize=10)
+    page.insert_text((320, 330), "Figure 2: right", fontsize=10)
+    boxes, texts, blocks = page_words(page)
+
+    tables = pdf_utils.extract_tables(boxes, texts, pdf_utils.horizontal_rule_positions(page), blocks=blocks)
+
+    assert len(tables) == 1
+    assert all("Figure" not in cell for row in tables[0]["rows"] for cell in row)
+
+
+def test_ocr_word_boxes_scales_to_page_coordinates():
+    data = {
+        "text": ["", "Region", "77", "noise"],
+        "conf": ["-1", "95", "90.5", "10"],
+        "left": [0, 100, 400, 10],
+        "top": [0, 200, 200, 10],
+        "width": [0, 80, 20, 5],
+        "height": [0, 20, 20, 5],
+        "block_num": [0, 1, 1, 2],
+    }
+
+    boxes, texts, blocks = pdf_utils.ocr_word_boxes(data, zoom=2)
+
+    assert texts == ["Region", "77"]
+    assert boxes.tolist() == [[50, 100, 90, 110], [200, 100, 210, 110]]
+    assert blocks.tolist() == [1, 1]
+
+
+def ocr_table_layout(rows=5, zoom=2):
+    """Tesseract image_to_data output for a table, in rendered-image pixels."""
+    data = {key: [] for key in ("text", "conf", "left", "top", "width", "height", "block_num")}
+    for row in range(rows):
+        for x, cell in zip([72, 200, 320, 440], ["Region", "1234", "5.5%", "77"]):
+            data["text"].append(cell)
+            data["conf"].append("95")
+            data["left"].append(x * zoom)
+            data["top"].append((100 + row * 18) * zoom)
+            data["width"].append(len(cell) * 6 * zoom)
+            data["height"].append(10 * zoom)
+            data["block_num"].append(1)
+    return data
+
+
+def test_extract_page_tables_uses_ocr_on_scans_with_a_native_footer(monkeypatch):
+    page = fitz.open().new_page()
+    page.insert_image(page.rect, pixmap=solid_pixmap((240, 240, 240)))
+    page.insert_text((72, 800), "Received 2024-03-01 BATES 000123", fontsize=8)
+    monkeypatch.setattr(pdf_utils.pytesseract, "image_to_data", lambda image, output_type: ocr_table_layout())
+    ocr_text = "Annual report " + "Region 1234 5.5% 77 " * 5 + "Received 2024-03-01 BATES 000123"
+
+    tables = pdf_utils.extract_page_tables(page, None, zoom=2, ocr_text=ocr_text)
+
+    assert len(tables) == 1
+    assert tables[0]["rows"] == [["Region", "1234", "5.5%", "77"]] * 5
+
+
+def test_extract_page_tables_uses_native_layer_on_digital_pages(monkeypatch):
+    page = fitz.open().new_page()
+    draw_ruled_table(page)
+    monkeypatch.setattr(pdf_utils.pytesseract, "image_to_data", lambda image, output_type: pytest.fail("OCR layout used"))
+    ocr_text = "Region 1234 5.5% 77 " * 5
+
+    tables = pdf_utils.extract_page_tables(page, None, zoom=2, ocr_text=ocr_text)
+
+    assert tables[0]["rows"] == [["Region", "1234", "5.5%", "77"]] * 5
+
+def form_page(doc, text, padding_pages=0):
+    """Add a page that draws `text` only through a Form XObject, as show_pdf_page does."""
+    src = fitz.open()
+    for _ in range(padding_pages):
+        src.new_page()
+    src_page = src.new_page()
+    src_page.insert_text((72, 72), text)
+    page = doc.new_page()
+    page.show_pdf_page(page.rect, src, padding_pages)
+    # Adding pages invalidates earlier page objects, so callers look pages up by number
+    return page.number
+
+
+def test_hash_page_covers_form_xobject_contents():
+    doc = fitz.open()
+    form_page(doc, "Quarterly revenue grew")
+    form_page(doc, "Quarterly revenue fell")
+    first, second = doc[0], doc[1]
+    assert first.read_contents() == second.read_contents()
+    assert pdf_utils.hash_page(doc, first) != pdf_utils.hash_page(doc, second)
+
+
+def test_hash_page_matches_identical_pages_across_files():
+    doc = fitz.open()
+    form_page(doc, "Quarterly revenue grew")
+    # Extra pages shift the object numbers in the second file
+    other = fitz.open()
+    other.new_page()
+    form_page(other, "Quarterly revenue grew", padding_pages=2)
+    assert pdf_utils.hash_page(doc, doc[0]) == pdf_utils.hash_page(other, other[1])
+
+
+def test_hash_page_shares_memo_across_pages():
+    doc = fitz.open()
+    form_page(doc, "Same text")
+    form_page(doc, "Same text")
+    memo = {}
+    assert pdf_utils.hash_page(doc, doc[0], memo) == pdf_utils.hash_page(doc, doc[1], memo)
+
+
+def test_hash_page_covers_annotations():
+    doc = fitz.open()
+    for _ in range(2):
+        doc.new_page().insert_text((72, 72), "Quarterly revenue grew")
+    doc[1].add_freetext_annot(fitz.Rect(72, 100, 300, 130), "APPROVED: restated figures")
+    assert doc[0].read_contents() == doc[1].read_contents()
+    assert pdf_utils.hash_page(doc, doc[0]) != pdf_utils.hash_page(doc, doc[1])
+
+
+def test_hash_page_of_annotated_page_ignores_other_pages():
+    hashes = []
+    for other_text in ("Appendix A", "Appendix B"):
+        doc = fitz.open()
+        doc.new_page().insert_text((72, 72), "Quarterly revenue grew")
+        doc[0].add_text_annot((72, 100), "Check this")
+        doc.new_page().insert_text((72, 72), other_text)
+        hashes.append(pdf_utils.hash_page(doc, doc[0]))
+    assert hashes[0] == hashes[1]
+
+
+def test_iter_pdf_pages_waits_for_fitz_lock(tmp_path):
+    path = tmp_path / "report.pdf"
+    doc = fitz.open()
+    doc.new_page().insert_text((72, 72), "Quarterly revenue grew")
+    doc.save(path)
+
+    pages = []
+    reader = threading.Thread(
+        target=lambda: pages.extend(pdf_utils.iter_pdf_pages(str(path), reuse_page=lambda page_hash: {"text": "stored"}))
+    )
+    with pdf_utils.FITZ_LOCK:
+        reader.start()
+        time.sleep(0.2)
+        assert not pages
+    reader.join(timeout=5)
+
+    assert [page["text"] for page in pages] == ["stored"]
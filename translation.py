@@ -2,22 +2,29 @@ import fitz  # PyMuPDF
 from googletrans import Translator
 import os
 import asyncio
+from metrics import timed, increment
+from pdf_utils import FITZ_LOCK
 
 async def translate_pdf_file(input_path: str, output_dir="outputs", target_lang: str = "es"):
     """
     Translate the text of a PDF from the input path and save the translated version to output path.
     """
-    doc = fitz.open(input_path)
+    # PyMuPDF calls hold FITZ_LOCK (uploads extract on other threads); it is never held across an await
+    with FITZ_LOCK:
+        doc = fitz.open(input_path)
+        page_count = len(doc)
     translator = Translator()
 
     # Define the output file path in the 'outputs' directory
     output_path = os.path.join(output_dir, "translated_output.pdf")
-    translated_doc = fitz.open()
+    with FITZ_LOCK:
+        translated_doc = fitz.open()
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text("dict")
-        new_page = translated_doc.new_page(width=page.rect.width, height=page.rect.height)
+    for page_num in range(page_count):
+        with FITZ_LOCK:
+            page = doc.load_page(page_num)
+            text = page.get_text("dict")
+            new_page = translated_doc.new_page(width=page.rect.width, height=page.rect.height)
 
         for block in text["blocks"]:
             if "lines" not in block:
@@ -29,11 +36,14 @@ async def translate_pdf_file(input_path: str, output_dir="outputs", target_lang:
                         continue
                     try:
                         # Await the translation coroutine and then access the .text attribute
-                        translated = await translator.translate(original_text, dest=target_lang)
+                        with timed("translate.span"):
+                            translated = await translator.translate(original_text, dest=target_lang)
                         translated_text = translated.text  # Correctly accessing the text attribute
+                        increment("spans_translated")
 
                     except Exception as e:
                         translated_text = original_text
+                        increment("spans_untranslated")
 
                     # Convert the color to the appropriate format (range 0-1 for RGB)
                     color = span["color"]
@@ -48,17 +58,21 @@ async def translate_pdf_file(input_path: str, output_dir="outputs", target_lang:
                         color = (0, 0, 0)
 
                     # Insert translated text with a fallback font (e.g., "helv" for Helvetica)
-                    new_page.insert_text(
-                        fitz.Point(span["bbox"][0], span["bbox"][1]),
-                        translated_text,
-                        fontsize=span["size"],
-                        fontname="helv",  # Default font
-                        color=color  # Corrected color format
-                    )
+                    with FITZ_LOCK:
+                        new_page.insert_text(
+                            fitz.Point(span["bbox"][0], span["bbox"][1]),
+                            translated_text,
+                            fontsize=span["size"],
+                            fontname="helv",  # Default font
+                            color=color  # Corrected color format
+                        )
 
-    translated_doc.save(output_path)
-    translated_doc.close()
-    doc.close()
+        increment("pages_translated")
+
+    with timed("translate.save"), FITZ_LOCK:
+        translated_doc.save(output_path)
+        translated_doc.close()
+        doc.close()
 
     print(f"Translated PDF saved to {output_path}")
     return output_path